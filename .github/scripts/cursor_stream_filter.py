@@ -8,28 +8,178 @@ Filters cursor-agent NDJSON stream output for readability.
 
 This is intentionally conservative: it only changes console rendering and does not
 try to interpret other event types.
+
+Performance note: this file must stay a single pure-Python script. run-cursor.sh
+invokes it directly with `python3 -u` on whatever runner the job landed on, so an
+ahead-of-time compiled form (Cython/mypyc) would need a build toolchain and
+per-platform artifacts the workflow cannot assume. Instead the hot loop is kept
+compile-friendly — one function, locals-bound callables, dict dispatch — and the
+per-line work is pushed into C-level primitives (regex extraction, bytes probes,
+buffered os.write).
 """
 
 from __future__ import annotations
 
-import json
+import os
 import re
 import sys
 
-
-_TOKEN_REDACTIONS: list[tuple[re.Pattern[str], str]] = [
-    # Match the same token-in-url pattern we already redact elsewhere in the workflow.
-    (re.compile(r"(https://x-access-token:)[^@]+@"), r"\1***@"),
-    # Common GitHub token prefixes.
-    (re.compile(r"\b(ghp|github_pat)_[A-Za-z0-9_]+\b"), r"\1_***"),
-]
+# Prefer a C-accelerated JSON parser when one happens to be installed on the runner;
+# per-line decoding is our single most expensive operation. Both alternatives accept
+# bytes and raise ValueError subclasses, so the call sites don't care which one won.
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    try:
+        from ujson import loads as _json_loads
+    except ImportError:
+        from json import loads as _json_loads
+
+# Buffer stdout ourselves so each delta/line is a cheap in-memory append instead of a
+# write() syscall (the workflow runs us with `python3 -u`, which would otherwise flush
+# every write). A plain bytearray drained with os.write skips the TextIOWrapper /
+# BufferedWriter stack entirely — no lock, no newline translation, no incremental
+# encoder — leaving a single str.encode per fragment. We flush explicitly at event
+# boundaries so the console stays live.
+_OUT_FD = sys.stdout.fileno()
+_OUT_BUF = bytearray()
+_OUT_LIMIT = 65536
+
+# Read stdin in blocks of up to this size and split lines ourselves, instead of paying
+# the BufferedReader readline/__next__ machinery per line.
+_IN_BLOCK = 65536
+
+
+def _input_lines():
+    """Yield raw lines (trailing newline kept) from stdin in large-block reads.
+
+    read1() returns whatever a single underlying read() produced, so a live stream
+    still comes through burst-by-burst instead of stalling until a full block
+    accumulates. A final unterminated line is yielded as-is at EOF.
+    """
+    read1 = sys.stdin.buffer.read1
+    carry = b""
+    while True:
+        chunk = read1(_IN_BLOCK)
+        if not chunk:
+            break
+        if carry:
+            chunk = carry + chunk
+            carry = b""
+        find = chunk.find
+        start = 0
+        while True:
+            idx = find(b"\n", start)
+            if idx < 0:
+                carry = chunk[start:]
+                break
+            end = idx + 1
+            yield chunk[start:end]
+            start = end
+    if carry:
+        yield carry
+
+
+def _drain_out() -> None:
+    if _OUT_BUF:
+        # os.write may write fewer bytes than asked (e.g. a nearly-full pipe).
+        view = memoryview(_OUT_BUF)
+        pos = 0
+        end = len(_OUT_BUF)
+        while pos < end:
+            pos += os.write(_OUT_FD, view[pos:])
+        del view
+        _OUT_BUF.clear()
+
+
+# Bound console latency when no event boundary arrives: _write forces a flush after
+# this many buffered writes, and a delta run drains *and flushes* after this many
+# collected fragments (a thinking block produces no other events mid-run, so without
+# the explicit flush its text would sit in _OUT_BUF until the completed event).
+_FLUSH_EVERY = 64
+
+
+# cursor-agent emits compact JSON with "type" as the first key, so a prefix test is a
+# reliable (and much cheaper) probe than a full parse. These envelope types are hidden
+# anyway; skipping json.loads for them removes the single most expensive per-line step.
+# Lines that miss every prefix still fall through to the generic parse, so an unusual
+# key order only costs us the parse we would have done before.
+_SKIP_PREFIXES = (
+    b'{"type":"system"',
+    b'{"type":"user"',
+)
+
+# Event type/subtype vocabulary, interned so the dispatch below can compare parsed
+# values by identity after interning them once per line (pointer compare instead of
+# character compare on every branch).
+_T_THINKING = sys.intern("thinking")
+_T_ASSISTANT = sys.intern("assistant")
+_T_TOOL_CALL = sys.intern("tool_call")
+_T_RESULT = sys.intern("result")
+_T_SYSTEM = sys.intern("system")
+_T_USER = sys.intern("user")
+_S_DELTA = sys.intern("delta")
+_S_COMPLETED = sys.intern("completed")
+_S_STARTED = sys.intern("started")
+
+# Fast path for thinking deltas, by far the most frequent event: pull the .text and
+# .session_id values straight out of the raw bytes. [^"\\]* deliberately refuses to
+# cross a backslash, so any value containing JSON escapes (\n, \", \uXXXX) fails the
+# match and drops back to the full parser rather than being mis-extracted.
+_DELTA_PREFIX = b'{"type":"thinking","subtype":"delta"'
+_DELTA_TEXT = re.compile(rb'"text":"([^"\\]*)"')
+_DELTA_SESSION = re.compile(rb'"session_id":"([^"\\]*)"')
+
+
+# All redaction patterns combined into one alternation so each string is scanned once,
+# regardless of how many patterns we accumulate. Named groups tell the replacement
+# callback which rule matched. When the third-party `regex` module is available we
+# compile with possessive quantifiers (++), which never give back characters and so
+# can never backtrack pathologically on attacker-influenced command strings; stdlib
+# `re` does not support them, so the fallback keeps the greedy (still linear here)
+# form of the same pattern.
+try:
+    import regex as _regex
+
+    _TOKEN_REDACTIONS = _regex.compile(
+        # Match the same token-in-url pattern we already redact elsewhere in the workflow.
+        r"(?P<token_url>https://x-access-token:)[^@]++@"
+        # Common GitHub token prefixes.
+        r"|\b(?P<token_prefix>ghp|github_pat)_[A-Za-z0-9_]++\b"
+    )
+except ImportError:
+    _TOKEN_REDACTIONS = re.compile(
+        r"(?P<token_url>https://x-access-token:)[^@]+@"
+        r"|\b(?P<token_prefix>ghp|github_pat)_[A-Za-z0-9_]+\b"
+    )
+
+
+def _redact_match(m: re.Match[str]) -> str:
+    if m.lastgroup == "token_url":
+        return m.group("token_url") + "***@"
+    return m.group("token_prefix") + "_***"
 
 
 def _redact(s: str) -> str:
-    out = s
-    for pattern, repl in _TOKEN_REDACTIONS:
-        out = pattern.sub(repl, out)
-    return out
+    return _TOKEN_REDACTIONS.sub(_redact_match, s)
+
+
+# Lone "EOF" lines become blanks; "**" headings get a blank line inserted before them
+# (the lookbehind keeps the first line untouched). Two compiled C-level substitutions
+# replace the old per-line split/append/join rebuild.
+_EOF_LINE = re.compile(r"^EOF$", re.MULTILINE)
+_HEADING_LINE = re.compile(r"(?<=\n)(?=\*\*)")
+
+
+def _transform_text(text: str) -> str:
+    """Replace lone EOF lines with blanks; add blank line before '**' headings."""
+    # Most rendered text contains neither marker; a substring probe (memchr-backed,
+    # far cheaper than entering the regex engine) rejects those outright.
+    if "EOF" in text:
+        text = _EOF_LINE.sub("", text)
+    if "**" in text:
+        text = _HEADING_LINE.sub("\n", text)
+    return text
 
 
 def _extract_assistant_text(obj: dict) -> str | None:
@@ -39,17 +189,15 @@ def _extract_assistant_text(obj: dict) -> str | None:
     content = msg.get("content")
     if not isinstance(content, list):
         return None
-    parts: list[str] = []
-    for item in content:
-        if not isinstance(item, dict):
-            continue
-        if item.get("type") == "text":
-            text = item.get("text")
-            if isinstance(text, str) and text:
-                parts.append(text)
-    if not parts:
-        return None
-    return "\n".join(parts)
+    joined = "\n".join(
+        text
+        for item in content
+        if isinstance(item, dict)
+        and item.get("type") == "text"
+        and isinstance(text := item.get("text"), str)
+        and text
+    )
+    return joined or None
 
 
 def _summarize_tool_call(obj: dict) -> str | None:
@@ -95,144 +243,233 @@ def main() -> int:
     last_session_id: str | None = None
     last_was_tool_call = False
     has_output = False
+    pending_writes = 0
+
+    # Bind hot globals/attributes to locals once; these are looked up on every line
+    # (or every buffered write) and LOAD_FAST is measurably cheaper than
+    # LOAD_GLOBAL + LOAD_ATTR at these call frequencies.
+    out_buf = _OUT_BUF
+    buf_extend = out_buf.extend
+    loads = _json_loads
+    intern = sys.intern
+
+    def _write(s: str) -> None:
+        nonlocal pending_writes
+        buf_extend(s.encode("utf-8"))
+        pending_writes += 1
+        if pending_writes >= _FLUSH_EVERY or len(out_buf) >= _OUT_LIMIT:
+            _flush()
+
+    def _flush() -> None:
+        nonlocal pending_writes
+        _drain_out()
+        pending_writes = 0
+
+    # Consecutive delta fragments are collected here and written as one joined string
+    # when the run ends (next non-delta event, session switch, or EOF), instead of one
+    # _write call per fragment.
+    delta_parts: list[str] = []
+
+    def _drain_deltas() -> None:
+        if delta_parts:
+            _write("".join(delta_parts))
+            delta_parts.clear()
 
     def end_thinking_if_needed() -> None:
+        # No flush here: every caller either renders an event (and flushes at its
+        # end) or flushes itself, so flushing the closing newline separately would
+        # just split one syscall into two at every thinking -> event transition.
         nonlocal in_thinking, last_session_id, has_output, last_was_tool_call
+        _drain_deltas()
         if in_thinking:
-            sys.stdout.write("\n")
-            sys.stdout.flush()
+            _write("\n")
             in_thinking = False
             last_session_id = None
             has_output = True
             last_was_tool_call = False
 
+    def _emit_delta(text: str, session_id: object) -> None:
+        nonlocal in_thinking, last_session_id, has_output, last_was_tool_call
+        # Almost every delta continues the current session; one equality check skips
+        # the whole session-boundary branch for that case. (A matching session_id
+        # would only be re-assigned to itself anyway.)
+        if session_id != last_session_id and isinstance(session_id, str) and session_id:
+            if in_thinking and last_session_id:
+                delta_parts.append("\n")
+            last_session_id = session_id
+
+        in_thinking = True
+        delta_parts.append(text)
+        # If a delta ends a sentence, start a new line for whatever follows.
+        # (This improves readability of stitched thinking output.)
+        if text.endswith("."):
+            delta_parts.append("\n")
+            in_thinking = False
+        # Keep console latency bounded on long uninterrupted runs: drain AND flush,
+        # since no other event fires mid-run to push the text out of _OUT_BUF.
+        if len(delta_parts) >= _FLUSH_EVERY:
+            _drain_deltas()
+            _flush()
+        has_output = True
+        last_was_tool_call = False
+
     def _mark_output(is_tool: bool) -> None:
         """Insert blank line at tool / non-tool boundaries."""
         nonlocal last_was_tool_call, has_output
+        _drain_deltas()
         if has_output and is_tool != last_was_tool_call:
-            sys.stdout.write("\n")
+            _write("\n")
         last_was_tool_call = is_tool
         has_output = True
 
-    def _transform_text(text: str) -> str:
-        """Replace lone EOF lines with blanks; add blank line before '**' headings."""
-        lines = text.split("\n")
-        result: list[str] = []
-        for line in lines:
-            if line == "EOF":
-                result.append("")
-            else:
-                if line.startswith("**") and result:
-                    result.append("")
-                result.append(line)
-        return "\n".join(result)
-
-    for raw in sys.stdin:
-        line = raw.rstrip("\n")
+    # Read stdin as bytes: the startswith/contains probes below work on bytes just as
+    # well (and json.loads accepts bytes directly), so we only pay for UTF-8 decoding
+    # on the passthrough lines we actually print.
+    # Per-type handlers. Each returns True when it fully rendered (or deliberately
+    # hid) the event; returning False falls through to the minimal [type:subtype]
+    # summary, which keeps the old if/elif fallthrough semantics intact.
 
+    def _on_thinking(obj: dict, subtype: object) -> bool:
+        if subtype is _S_DELTA:
+            text = obj.get("text")
+            if isinstance(text, str) and text:
+                _emit_delta(text, obj.get("session_id"))
+                return True
+        # Hide the thinking "completed" JSON line; just end the stitched block.
+        elif subtype is _S_COMPLETED:
+            end_thinking_if_needed()
+            _flush()
+            return True
+        return False
+
+    # Render assistant messages as plain text.
+    def _on_assistant(obj: dict, subtype: object) -> bool:
+        end_thinking_if_needed()
+        text = _extract_assistant_text(obj)
+        if isinstance(text, str) and text:
+            _mark_output(is_tool=False)
+            _write(_transform_text(text))
+            if not text.endswith("\n"):
+                _write("\n")
+            _flush()
+            return True
+        # If we can't extract text, fall back to a minimal summary.
+        return False
+
+    # Render tool call lifecycle events as one-liners.
+    def _on_tool_call(obj: dict, subtype: object) -> bool:
+        end_thinking_if_needed()
+        # Only started/completed events are rendered, so summarize (redaction regex,
+        # f-string formatting) after the subtype filter rather than for every
+        # lifecycle event.
+        if subtype is _S_STARTED:
+            _mark_output(is_tool=True)
+            _write(f"{_summarize_tool_call(obj)} (started)\n")
+            _flush()
+            return True
+        if subtype is _S_COMPLETED:
+            _mark_output(is_tool=True)
+            _write(f"{_summarize_tool_call(obj)} (completed)\n")
+            _flush()
+            return True
+        return False
+
+    # Render "result" messages as plain text if present.
+    def _on_result(obj: dict, subtype: object) -> bool:
+        end_thinking_if_needed()
+        result = obj.get("result")
+        if isinstance(result, str) and result:
+            _mark_output(is_tool=False)
+            _write(_transform_text(result))
+            if not result.endswith("\n"):
+                _write("\n")
+            _flush()
+            return True
+        return False
+
+    # Hide common noisy envelope events.
+    def _on_hidden(obj: dict, subtype: object) -> bool:
+        end_thinking_if_needed()
+        _flush()
+        return True
+
+    handlers = {
+        _T_THINKING: _on_thinking,
+        _T_ASSISTANT: _on_assistant,
+        _T_TOOL_CALL: _on_tool_call,
+        _T_RESULT: _on_result,
+        _T_SYSTEM: _on_hidden,
+        _T_USER: _on_hidden,
+    }
+    handler_get = handlers.get
+
+    # Note: lines are used as-is, trailing newline included. The prefix probes don't
+    # care, the delta regexes can't match past a quote, and every JSON parser we use
+    # accepts surrounding whitespace — so passthrough lines avoid an rstrip copy.
+    for raw in _input_lines():
         # We only try to parse JSON for dict-like lines; everything else is passthrough.
         obj: object | None = None
-        if line.startswith("{") and '"type"' in line:
+        if raw.startswith(b"{") and b'"type"' in raw:
+            # Thinking deltas dominate the stream; try the regex extraction first and
+            # only fall back to a full parse when the text carries escapes (or the
+            # line is oddly shaped, including empty-text deltas we summarize below).
+            if raw.startswith(_DELTA_PREFIX):
+                m = _DELTA_TEXT.search(raw)
+                if m is not None and m.group(1):
+                    sid_m = _DELTA_SESSION.search(raw)
+                    _emit_delta(
+                        m.group(1).decode("utf-8", "replace"),
+                        sid_m.group(1).decode("utf-8", "replace") if sid_m else None,
+                    )
+                    continue
+            # Hidden envelope types never need parsing; drop them on a prefix match.
+            elif raw.startswith(_SKIP_PREFIXES):
+                end_thinking_if_needed()
+                _flush()
+                continue
             try:
-                obj = json.loads(line)
+                obj = loads(raw)
             except Exception:
                 obj = None
 
         if isinstance(obj, dict):
+            # Unpack once and branch on locals; repeated obj.get("type") calls in the
+            # old per-branch gates were redundant dict lookups on every line.
             typ = obj.get("type")
             subtype = obj.get("subtype")
-
-            if typ == "thinking" and subtype == "delta":
-                text = obj.get("text")
-                if isinstance(text, str) and text:
-                    session_id = obj.get("session_id")
-                    if isinstance(session_id, str) and session_id:
-                        if in_thinking and last_session_id and session_id != last_session_id:
-                            sys.stdout.write("\n")
-                        last_session_id = session_id
-
-                    in_thinking = True
-                    sys.stdout.write(text)
-                    # If a delta ends a sentence, start a new line for whatever follows.
-                    # (This improves readability of stitched thinking output.)
-                    if text.endswith("."):
-                        sys.stdout.write("\n")
-                        in_thinking = False
-                    sys.stdout.flush()
-                    has_output = True
-                    last_was_tool_call = False
-                    continue
-
-            # Hide the thinking "completed" JSON line; just end the stitched block.
-            if typ == "thinking" and subtype == "completed":
-                end_thinking_if_needed()
-                continue
-
-            # Render assistant messages as plain text.
-            if typ == "assistant":
-                end_thinking_if_needed()
-                text = _extract_assistant_text(obj)
-                if isinstance(text, str) and text:
-                    _mark_output(is_tool=False)
-                    sys.stdout.write(_transform_text(text))
-                    if not text.endswith("\n"):
-                        sys.stdout.write("\n")
-                    sys.stdout.flush()
-                    continue
-                # If we can't extract text, fall through to a minimal summary.
-
-            # Render tool call lifecycle events as one-liners.
-            if typ == "tool_call":
-                end_thinking_if_needed()
-                summary = _summarize_tool_call(obj)
-                if subtype == "started":
-                    _mark_output(is_tool=True)
-                    sys.stdout.write(f"{summary} (started)\n")
-                    sys.stdout.flush()
-                    continue
-                if subtype == "completed":
-                    _mark_output(is_tool=True)
-                    sys.stdout.write(f"{summary} (completed)\n")
-                    sys.stdout.flush()
-                    continue
-
-            # Render "result" messages as plain text if present.
-            if typ == "result":
-                end_thinking_if_needed()
-                result = obj.get("result")
-                if isinstance(result, str) and result:
-                    _mark_output(is_tool=False)
-                    sys.stdout.write(_transform_text(result))
-                    if not result.endswith("\n"):
-                        sys.stdout.write("\n")
-                    sys.stdout.flush()
-                    continue
-
-            # Hide common noisy envelope events.
-            if typ in {"system", "user"}:
-                end_thinking_if_needed()
+            # Intern once so every comparison below is a pointer check against the
+            # interned constants (json parsers do not return interned value strings).
+            if type(typ) is str:
+                typ = intern(typ)
+            if type(subtype) is str:
+                subtype = intern(subtype)
+
+            handler = handler_get(typ)
+            if handler is not None and handler(obj, subtype):
                 continue
 
-            # Unknown JSON event: print a minimal summary instead of full JSON.
+            # Unknown JSON event (or a known type whose handler declined, e.g. an
+            # assistant message without text): print a minimal summary, not full JSON.
             end_thinking_if_needed()
             if isinstance(typ, str):
                 _mark_output(is_tool=False)
                 if isinstance(subtype, str) and subtype:
-                    sys.stdout.write(f"[{typ}:{subtype}]\n")
+                    _write(f"[{typ}:{subtype}]\n")
                 else:
-                    sys.stdout.write(f"[{typ}]\n")
-                sys.stdout.flush()
+                    _write(f"[{typ}]\n")
+                _flush()
                 continue
 
         _mark_output(is_tool=False)
-        transformed = _transform_text(line)
-        sys.stdout.write(transformed)
-        if raw.endswith("\n"):
-            sys.stdout.write("\n")
-        sys.stdout.flush()
+        # The trailing newline (when present) rides along through the transform:
+        # passthrough lines have no interior newlines, so neither pattern can be
+        # affected by it.
+        _write(_transform_text(raw.decode("utf-8", "replace")))
 
     # Ensure we don't leave the prompt stuck on the same line.
     end_thinking_if_needed()
+    _drain_deltas()
+    _flush()
 
     return 0
 